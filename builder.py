@@ -59,6 +59,11 @@ DEFAULT_CONFIG = collections.OrderedDict((
                 ('beta', True),
                 ('file_suffix', "")
     ))),
+    ('ImageSize', collections.OrderedDict((
+                ('gl-ar150', ''),
+                ('gl-mt300a', ''),
+                ('gl-6416', ''),
+    ))),
 ))
 
 def build_steps(config):
@@ -69,8 +74,8 @@ def build_steps(config):
     #
     steps = []
     if config.getboolean("LEDE", "update_git"):
-        sb.add_cmd("git clone https://github.com/lede-project/source lede-source").if_dir_not_exists('lede-source')
-        sb.add_cmd("git fetch").at("lede-source")
+        sb.add_cmd("git clone https://github.com/lede-project/source lede-source").retry().if_dir_not_exists('lede-source')
+        sb.add_cmd("git fetch").at("lede-source").retry()
         sb.add(GitBranchStep(config.get("LEDE", "source_branch"), "lede-source"))
         # pull errors if the 'branch' is a detached head, so it may fail
         sb.add_cmd("git pull").at("lede-source").may_fail()
@@ -80,8 +85,8 @@ def build_steps(config):
     #
     sidn_pkg_feed_dir = "sidn_openwrt_pkgs"
     if config.getboolean("sidn_openwrt_pkgs", "update_git"):
-        sb.add_cmd("git clone https://github.com/SIDN/sidn_openwrt_pkgs %s" % sidn_pkg_feed_dir).if_dir_not_exists('sidn_openwrt_pkgs')
-        sb.add_cmd("git fetch").at("sidn_openwrt_pkgs")
+        sb.add_cmd("git clone https://github.com/SIDN/sidn_openwrt_pkgs %s" % sidn_pkg_feed_dir).retry().if_dir_not_exists('sidn_openwrt_pkgs')
+        sb.add_cmd("git fetch").at("sidn_openwrt_pkgs").retry()
         sb.add(GitBranchStep(config.get("sidn_openwrt_pkgs", "source_branch"), "sidn_openwrt_pkgs"))
         sb.add_cmd("git pull").at("sidn_openwrt_pkgs").may_fail()
 
@@ -92,10 +97,10 @@ def build_steps(config):
     #
     if config.getboolean("SPIN", "local"):
         if config.getboolean("SPIN", "update_git"):
-            sb.add_cmd("git clone https://github.com/SIDN/spin").if_dir_not_exists("spin")
+            sb.add_cmd("git clone https://github.com/SIDN/spin").retry().if_dir_not_exists("spin")
 
             # only relevant if we use a local build of spin
-            sb.add_cmd("git fetch").at("spin")
+            sb.add_cmd("git fetch").at("spin").retry()
             sb.add(GitBranchStep(config.get("SPIN", "source_branch"), "spin"))
             sb.add_cmd("git pull").at("spin").may_fail()
 
@@ -114,19 +119,20 @@ def build_steps(config):
 
     #
     # Update general package feeds in LEDE
+    # (feed updates fetch from the network, so they are retried on failure)
     #
     sb.add(UpdateFeedsConf("lede-source", sidn_pkg_feed_dir))
     if config.getboolean('LEDE', 'update_all_feeds'):
         # Always update all feeds
-        sb.add_cmd("./scripts/feeds update -a").at("lede-source")
+        sb.add_cmd("./scripts/feeds update -a").at("lede-source").retry()
         sb.add_cmd("./scripts/feeds install -a").at("lede-source")
     else:
         # Only update sidn feed if the rest have been installed already
-        sb.add_cmd("./scripts/feeds update sidn").at("lede-source").if_dir_exists("package/feeds/packages")
+        sb.add_cmd("./scripts/feeds update sidn").at("lede-source").retry().if_dir_exists("package/feeds/packages")
         sb.add_cmd("./scripts/feeds install -a -p sidn").at("lede-source").if_dir_exists("package/feeds/packages")
 
         # Update all feeds if they haven't been installed already
-        sb.add_cmd("./scripts/feeds update -a").at("lede-source").if_dir_not_exists("package/feeds/packages")
+        sb.add_cmd("./scripts/feeds update -a").at("lede-source").retry().if_dir_not_exists("package/feeds/packages")
         sb.add_cmd("./scripts/feeds install -a").at("lede-source").if_dir_not_exists("package/feeds/packages")
 
 
@@ -151,8 +157,11 @@ def build_steps(config):
 
     #
     # Build the LEDE image(s)
+    # (each target is built independently, so that with --keep-going a
+    # failure in one target does not stop the others)
     #
     for target in targets:
+        sb.set_target(target)
         valibox_build_tools_dir = get_valibox_build_tools_dir()
         sb.add_cmd("cp -r ../%s/devices/%s/files ./files" % (valibox_build_tools_dir, target)).at( "lede-source")
         sb.add(ValiboxVersionStep(version_string)).at("lede-source")
@@ -162,6 +171,9 @@ def build_steps(config):
         if config.getboolean("LEDE", "verbose_build"):
             build_cmd += " -j1 V=s"
         sb.add_cmd(build_cmd).at("lede-source")
+        sb.add(ImageSizeStep(target, os.path.abspath(valibox_build_tools_dir), get_size_budget(config, target),
+                    config.get("Release", "target_directory")).at("lede-source"))
+    sb.set_target(None)
 
     #
     # And finally, move them into a release directory structure
@@ -173,11 +185,48 @@ def build_steps(config):
 
         sb.add(CreateReleaseStep(targets, os.path.abspath(get_valibox_build_tools_dir()),
                     version_string, changelog_file,
-                    config.get("Release", "target_directory")).at("lede-source"))
+                    config.get("Release", "target_directory"),
+                    dict((target, get_size_budget(config, target)) for target in targets)).at("lede-source"))
 
     return sb.steps
 
 
+# Return the maximum image size in bytes for the given value from the
+# ImageSize section (in KiB), or None if it is empty.
+# Raises ValueError if the value is not a whole number of KiB
+def parse_size_budget(value):
+    if value.strip() == "":
+        return None
+    budget = int(value)
+    if budget < 0:
+        raise ValueError("negative size")
+    return budget * 1024
+
+
+# Return the maximum image size in bytes for the given target, or None if
+# it has no (valid) budget; invalid values are reported by check_config_values
+def get_size_budget(config, target):
+    if not config.has_option("ImageSize", target):
+        return None
+    try:
+        return parse_size_budget(config.get("ImageSize", target))
+    except ValueError:
+        return None
+
+
+# Return a list of errors in the configuration values that can not be
+# used for building
+def check_config_values(config):
+    errors = []
+    for option in config.options("ImageSize"):
+        value = config.get("ImageSize", option)
+        try:
+            parse_size_budget(value)
+        except ValueError:
+            errors.append("Invalid value '%s' for option %s in section ImageSize: this should be a whole number of KiB, or empty" % (value, option))
+    return errors
+
+
 # Return the directory of this toolkit; needed to get device information
 def get_valibox_build_tools_dir():
     return os.path.dirname(__file__)
@@ -188,6 +237,7 @@ def main():
     parser.add_argument('-b', '--build', action="store_true", help='Start or continue the build from the latest step in the last run')
     parser.add_argument('-r', '--restart', action="store_true", help='(Re)start the build from the first step')
     parser.add_argument('-e', '--edit', action="store_true", help='Edit the build configuration options')
+    parser.add_argument('-k', '--keep-going', action="store_true", help='Do not stop at the first failed step, but continue building the targets that do not depend on it (with -b or -r)')
     parser.add_argument('-c', '--config', default=BuildConfig.CONFIG_FILE, help="Specify the build config file to use (defaults to %s)" % BuildConfig.CONFIG_FILE)
     #parser.add_argument('--check', action="store_true", help='Check the build configuration options')
     parser.add_argument('--print-steps', action="store_true", help='Print all the steps that would be performed')
@@ -196,11 +246,25 @@ def main():
     config = BuildConfig(args.config, DEFAULT_CONFIG)
     builder = Builder(build_steps(config))
 
+    config_errors = check_config_values(config)
+    for error in config_errors:
+        print(error)
+    if config_errors and (args.build or args.restart):
+        print("Use -e to edit the build configuration")
+        sys.exit(1)
+
     if args.build:
-        builder.perform_steps()
+        if args.keep_going:
+            builder.perform_steps_keep_going()
+        else:
+            builder.perform_steps()
     elif args.restart:
         builder.last_step = 1
-        builder.perform_steps()
+        if args.keep_going:
+            builder.clear_step_results()
+            builder.perform_steps_keep_going()
+        else:
+            builder.perform_steps()
     elif args.edit:
         EDITOR = os.environ.get('EDITOR','vim')
         config.save_config()
@@ -5,6 +5,7 @@ from .steps import *
 import collections
 import configparser
 import datetime
+import time
 
 
 class BuildConfig:
@@ -35,15 +36,28 @@ class BuildConfig:
     def getboolean(self, section, option):
         return self.config.getboolean(section, option)
 
+    def has_option(self, section, option):
+        return self.config.has_option(section, option)
+
+    def options(self, section):
+        return self.config.options(section)
+
 
 class Builder:
     """
     This class creates and performs the actual steps in the configured
     build process
     """
+    STEP_RESULTS_FILE = ".step_results"
+
+    STEP_OK = "ok"
+    STEP_FAILED = "failed"
+    STEP_BLOCKED = "blocked"
+
     def __init__(self, steps):
         self.steps = steps
         self.read_last_step()
+        self.read_step_results()
 
     def read_last_step(self):
         self.last_step = None
@@ -69,21 +83,171 @@ class Builder:
         with open(".last_step", "w") as out:
             out.write("%d\n" % self.last_step)
 
+    # The results of the steps of a keep-going run, one line per step:
+    # <step number> <result>
+    def read_step_results(self):
+        self.step_results = {}
+        if os.path.exists(Builder.STEP_RESULTS_FILE):
+            with open(Builder.STEP_RESULTS_FILE) as inf:
+                for line in inf.readlines():
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self.step_results[int(parts[0])] = parts[1]
+
+    def save_step_results(self):
+        with open(Builder.STEP_RESULTS_FILE, "w") as out:
+            for number in sorted(self.step_results):
+                out.write("%d %s\n" % (number, self.step_results[number]))
+
+    def clear_step_results(self):
+        self.step_results = {}
+        if os.path.exists(Builder.STEP_RESULTS_FILE):
+            os.remove(Builder.STEP_RESULTS_FILE)
+
+    def get_targets(self):
+        targets = []
+        for step in self.steps:
+            if step.target is not None and step.target not in targets:
+                targets.append(step.target)
+        return targets
+
+    def get_first_step(self, target):
+        """
+        Returns the number of the first step of the given target
+        """
+        for number, step in enumerate(self.steps, 1):
+            if step.target == target:
+                return number
+        return None
+
+    def perform_step(self, number, step):
+        """
+        Performs a single step; if it fails and the step has a retry
+        policy, it is retried until it succeeds or the policy gives up
+        """
+        if step.perform():
+            return True
+        if step.retry_policy is not None:
+            attempt = 1
+            for delay in step.retry_policy.delays():
+                attempt += 1
+                print("step %d failed, retrying in %d seconds (attempt %d of %d)" % (number, delay, attempt, step.retry_policy.attempts))
+                time.sleep(delay)
+                if step.perform():
+                    return True
+        return False
+
     def perform_steps(self):
         if self.last_step is not None and self.last_step > len(self.steps):
             print("Build already completed, use -r to restart from first step")
+        # A regular run only tracks the last step, results of an
+        # earlier keep-going run are no longer valid after this
+        self.clear_step_results()
         failed_step = None
         if self.last_step is None:
             self.last_step = 1
         for step in self.steps[self.last_step - 1:]:
             self.save_last_step()
             print("step %d: %s" % (self.last_step, step))
-            if not step.perform():
+            if not self.perform_step(self.last_step, step):
                 print("step %d FAILED: %s" % (self.last_step, step))
                 return self.last_step
             self.last_step += 1
         self.save_last_step()
 
+    def perform_steps_keep_going(self):
+        """
+        Performs the steps without stopping at the first failure. When
+        a step fails, the remaining steps of its target are skipped,
+        but the other targets are still built. A failure in a step that
+        is shared by all targets blocks all steps after it.
+
+        When resumed, only the targets that have failed or blocked
+        steps are built again (from their first step, since the targets
+        share the lede-source tree), together with any failed or
+        blocked shared steps.
+
+        Returns the number of the first failed step, or None if all
+        steps succeeded.
+        """
+        if not self.step_results and self.last_step is not None:
+            # Continue where an earlier regular run stopped
+            for number in range(1, min(self.last_step, len(self.steps) + 1)):
+                self.step_results[number] = Builder.STEP_OK
+
+        rerun_targets = set()
+        for number, step in enumerate(self.steps, 1):
+            if step.target is not None and self.step_results.get(number) != Builder.STEP_OK:
+                rerun_targets.add(step.target)
+
+        if all(self.step_results.get(number) == Builder.STEP_OK for number in range(1, len(self.steps) + 1)):
+            print("Build already completed, use -r to restart from first step")
+            return None
+
+        failed_targets = set()
+        shared_failed = False
+        for number, step in enumerate(self.steps, 1):
+            if self.step_results.get(number) == Builder.STEP_OK and step.target not in rerun_targets:
+                continue
+            if shared_failed or step.target in failed_targets or\
+               (step.target is None and failed_targets):
+                print("step %d SKIPPED, it depends on a failed step: %s" % (number, step))
+                self.step_results[number] = Builder.STEP_BLOCKED
+            else:
+                print("step %d: %s" % (number, step))
+                if self.perform_step(number, step):
+                    self.step_results[number] = Builder.STEP_OK
+                else:
+                    print("step %d FAILED: %s" % (number, step))
+                    self.step_results[number] = Builder.STEP_FAILED
+            if self.step_results[number] != Builder.STEP_OK:
+                if step.target is None:
+                    shared_failed = True
+                else:
+                    failed_targets.add(step.target)
+            self.save_step_results()
+
+        # Keep .last_step consistent, so that a regular run resumes
+        # at the first step that did not succeed; if that step belongs
+        # to a target, the target is built again from its first step,
+        # since later targets have changed the lede-source tree
+        self.last_step = len(self.steps) + 1
+        for number, step in enumerate(self.steps, 1):
+            if self.step_results.get(number) != Builder.STEP_OK:
+                self.last_step = number
+                if step.target is not None:
+                    self.last_step = self.get_first_step(step.target)
+                break
+        self.save_last_step()
+
+        self.print_step_results()
+        for number in sorted(self.step_results):
+            if self.step_results[number] == Builder.STEP_FAILED:
+                return number
+        return None
+
+    def print_step_results(self):
+        """
+        Prints the success or failure of the shared steps and of
+        each target
+        """
+        print("Build results:")
+        for target in [None] + self.get_targets():
+            result = "ok"
+            for number, step in enumerate(self.steps, 1):
+                if step.target != target:
+                    continue
+                step_result = self.step_results.get(number)
+                if step_result == Builder.STEP_FAILED:
+                    result = "FAILED at step %d (%s): %s" % (number, step.failure_class(), str(step).split("\n")[-1].strip())
+                    break
+                elif step_result != Builder.STEP_OK:
+                    result = "SKIPPED, depends on a failed step"
+                    break
+            if target is None:
+                target = "(all targets)"
+            print("    %-16s%s" % (target, result))
+
 
 
 
@@ -94,11 +258,21 @@ class StepBuilder:
     """
     def __init__(self):
         self.steps = []
+        self.target = None
+
+    def set_target(self, target):
+        """
+        Mark all steps that are added after this as part of the build
+        of the given target (None for steps shared by all targets)
+        """
+        self.target = target
 
     def add(self, step):
         """
         Add any type of Step
         """
+        if step.target is None:
+            step.target = self.target
         self.steps.append(step)
         return step
 
@@ -0,0 +1,275 @@
+#
+# Image size accounting
+#
+
+#
+# The devices we build for have little flash, so every release should
+# be checked for growth. This module breaks a built sysupgrade image
+# down into its kernel, root filesystem and the packages installed in
+# it, writes that down in a json report, and compares it with the
+# report of a previous release.
+#
+# All functions are run from the lede-source directory, after the
+# image has been built. The build directories of a board are reused
+# when another device of the same board is built, so the analysis
+# has to be done right after each device's build.
+#
+# Package sizes are the uncompressed sizes of the files they install
+# in the root filesystem; since that filesystem is compressed, the
+# size of the package's .ipk file is added as an indication of its
+# share of the image.
+#
+
+import glob
+import json
+import os
+
+class ImageSizeError(Exception):
+    pass
+
+# Name used for the files in the root filesystem that do not belong
+# to any package (e.g. the files/ directory of the device)
+OTHER_FILES = "(other files)"
+
+def get_file_size(filename):
+    if filename is None or not os.path.exists(filename):
+        return None
+    return os.path.getsize(filename)
+
+def find_file(patterns):
+    """
+    Returns the first existing file that matches one of the given
+    glob patterns, or None
+    """
+    for pattern in patterns:
+        for filename in sorted(glob.glob(pattern)):
+            if os.path.isfile(filename):
+                return filename
+    return None
+
+def find_dir(pattern):
+    """
+    Returns the most recently modified directory that matches the
+    given glob pattern, or None. Leftovers of builds with another
+    toolchain can match as well, so a warning is printed if there is
+    more than one match
+    """
+    dirnames = [dirname for dirname in glob.glob(pattern) if os.path.isdir(dirname)]
+    if len(dirnames) == 0:
+        return None
+    dirname = max(dirnames, key=os.path.getmtime)
+    if len(dirnames) > 1:
+        print("Warning: %d directories match %s, using the most recent one: %s" % (len(dirnames), pattern, dirname))
+    return dirname
+
+def read_opkg_status(status_file):
+    """
+    Returns a dict of package name -> version, of the packages listed
+    in the given opkg status file
+    """
+    packages = {}
+    name = None
+    with open(status_file) as inf:
+        for line in inf.readlines():
+            if line.startswith("Package:"):
+                name = line.partition(":")[2].strip()
+                packages[name] = ""
+            elif line.startswith("Version:") and name is not None:
+                packages[name] = line.partition(":")[2].strip()
+    return packages
+
+def get_files_size(root_dir, filenames):
+    """
+    Returns the total size of the given files (relative to root_dir),
+    symlinks and directories are not counted
+    """
+    total = 0
+    for filename in filenames:
+        path = os.path.join(root_dir, filename.lstrip("/"))
+        if os.path.isfile(path) and not os.path.islink(path):
+            total += os.path.getsize(path)
+    return total
+
+def get_tree_size(root_dir):
+    """
+    Returns the total size of all files below root_dir, relative to
+    root_dir
+    """
+    files = []
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(dirpath, filename), root_dir))
+    return get_files_size(root_dir, files)
+
+
+class ImageSizeAnalyzer:
+    """
+    Creates the size report of one built device image
+    """
+    def __init__(self, device, image_file, budget=None):
+        # image_file is the path of the image relative to bin/targets,
+        # as specified in the image_info file of the device
+        self.device = device
+        self.image_file = image_file
+        self.budget = budget
+        parts = image_file.split("/")
+        if len(parts) < 3:
+            raise ImageSizeError("Image path should be <board>/<subtarget>/<file>: %s" % image_file)
+        self.board = parts[0]
+        self.subtarget = parts[1]
+        # The LEDE name of the device, used in the names of its build
+        # files, e.g. openwrt-ar71xx-generic-gl-ar150-squashfs-sysupgrade.bin
+        # is built for gl-ar150
+        self.lede_device = None
+        prefix = "openwrt-%s-%s-" % (self.board, self.subtarget)
+        suffix = "-squashfs-sysupgrade.bin"
+        image_name = parts[-1]
+        if image_name.startswith(prefix) and image_name.endswith(suffix) and\
+           len(image_name) > len(prefix) + len(suffix):
+            self.lede_device = image_name[len(prefix):-len(suffix)]
+
+    def get_image_path(self):
+        return "bin/targets/%s" % self.image_file
+
+    def get_report_path(self):
+        return self.get_image_path() + ".sizes.json"
+
+    def get_root_dir(self):
+        return find_dir("build_dir/target-*/root-%s" % self.board)
+
+    def get_linux_dir(self):
+        return find_dir("build_dir/target-*/linux-%s_%s" % (self.board, self.subtarget))
+
+    def get_kernel_file(self):
+        # Devices of the same board share the linux directory, so only
+        # the kernel built for this device is used
+        linux_dir = self.get_linux_dir()
+        if linux_dir is None or self.lede_device is None:
+            return None
+        return find_file(["%s/%s-kernel.bin" % (linux_dir, self.lede_device),
+                          "%s/vmlinux-%s.*" % (linux_dir, self.lede_device)])
+
+    def get_rootfs_file(self):
+        linux_dir = self.get_linux_dir()
+        if linux_dir is None:
+            return None
+        return find_file(["%s/root.squashfs" % linux_dir])
+
+    def get_ipk_size(self, name, version):
+        ipk_name = "%s_%s_*.ipk" % (name, version)
+        return get_file_size(find_file(["bin/targets/%s/%s/packages/%s" % (self.board, self.subtarget, ipk_name),
+                                        "bin/packages/*/*/%s" % ipk_name]))
+
+    def get_packages(self, root_dir):
+        packages = {}
+        status_file = os.path.join(root_dir, "usr/lib/opkg/status")
+        if not os.path.exists(status_file):
+            raise ImageSizeError("Package status file does not exist: %s" % status_file)
+        packaged_size = 0
+        for name, version in read_opkg_status(status_file).items():
+            list_file = os.path.join(root_dir, "usr/lib/opkg/info/%s.list" % name)
+            installed_size = 0
+            if os.path.exists(list_file):
+                with open(list_file) as inf:
+                    installed_size = get_files_size(root_dir, [line.split("\t")[0].strip() for line in inf.readlines()])
+            packaged_size += installed_size
+            packages[name] = {
+                "version": version,
+                "installed_size": installed_size,
+                "ipk_size": self.get_ipk_size(name, version)
+            }
+        packages[OTHER_FILES] = {
+            "version": "",
+            "installed_size": max(0, get_tree_size(root_dir) - packaged_size),
+            "ipk_size": None
+        }
+        return packages
+
+    def analyze(self):
+        image_size = get_file_size(self.get_image_path())
+        if image_size is None:
+            raise ImageSizeError("Image file does not exist: %s" % self.get_image_path())
+        root_dir = self.get_root_dir()
+        if root_dir is None:
+            raise ImageSizeError("Root filesystem directory for %s not found in build_dir" % self.board)
+        return {
+            "device": self.device,
+            "image": self.image_file,
+            "image_size": image_size,
+            "kernel_size": get_file_size(self.get_kernel_file()),
+            "rootfs_size": get_file_size(self.get_rootfs_file()),
+            "budget": self.budget,
+            "packages": self.get_packages(root_dir)
+        }
+
+
+def read_report(filename):
+    with open(filename) as inf:
+        return json.load(inf)
+
+def write_report(report, filename):
+    with open(filename, "w") as out:
+        json.dump(report, out, indent=2, sort_keys=True)
+        out.write("\n")
+
+def find_previous_report(release_dir, image_name):
+    """
+    Returns the size report of the image in the release that is
+    currently in release_dir (as listed in its versions.txt), or None
+    if there is no such release or it has no size report
+    """
+    versions_file = os.path.join(release_dir, "versions.txt")
+    if not os.path.exists(versions_file):
+        return None
+    with open(versions_file) as inf:
+        for line in inf.readlines():
+            parts = line.split(" ")
+            if len(parts) > 1 and parts[0] == image_name:
+                report_file = os.path.join(release_dir, image_name, "%s.sizes.json" % parts[1])
+                if os.path.exists(report_file):
+                    report = read_report(report_file)
+                    report["version"] = parts[1]
+                    return report
+    return None
+
+def compare_reports(report, previous):
+    """
+    Returns the size differences between two reports; for the image
+    parts, and for all packages that changed in size (including
+    packages that were added or removed)
+    """
+    def delta(new, old):
+        if new is None or old is None:
+            return None
+        return new - old
+
+    packages = {}
+    for name in set(report["packages"]) | set(previous["packages"]):
+        new_size = report["packages"].get(name, {}).get("installed_size", 0)
+        old_size = previous["packages"].get(name, {}).get("installed_size", 0)
+        if new_size != old_size:
+            packages[name] = new_size - old_size
+    return {
+        "version": previous.get("version"),
+        "image_size": delta(report["image_size"], previous["image_size"]),
+        "kernel_size": delta(report["kernel_size"], previous["kernel_size"]),
+        "rootfs_size": delta(report["rootfs_size"], previous["rootfs_size"]),
+        "packages": packages
+    }
+
+def check_budget(report):
+    if report["budget"] is not None and report["image_size"] > report["budget"]:
+        raise ImageSizeError("Image for %s is %d bytes, which exceeds its budget of %d bytes by %d bytes" %
+            (report["device"], report["image_size"], report["budget"], report["image_size"] - report["budget"]))
+
+def print_report(report, max_packages=10):
+    print("Image size of %s: %s bytes (kernel: %s, rootfs: %s, budget: %s)" %
+        (report["device"], report["image_size"], report["kernel_size"], report["rootfs_size"], report["budget"]))
+    packages = sorted(report["packages"].items(), key=lambda item: item[1]["installed_size"], reverse=True)
+    for name, info in packages[:max_packages]:
+        print("    %-32s%10d" % (name, info["installed_size"]))
+    if "previous" in report:
+        changes = report["previous"]
+        print("Compared to release %s: image %+d bytes" % (changes["version"], changes["image_size"]))
+        for name, change in sorted(changes["packages"].items(), key=lambda item: abs(item[1]), reverse=True)[:max_packages]:
+            print("    %-32s%+10d" % (name, change))
@@ -20,11 +20,29 @@ import os
 import shutil
 import sys
 
+from .imagesize import *
+
 class ReleaseEnvironmentError(Exception):
     pass
 
+def read_image_info(target_info_base_dir, target):
+    """
+    Returns the (name, path) of the image of the given target, as
+    specified in its image_info file
+    """
+    info_file = os.path.join(target_info_base_dir, "devices", target, "image_info")
+    if not os.path.exists(info_file):
+        raise ReleaseEnvironmentError("Image information file does not exist: %s" % info_file)
+
+    with open(info_file) as inf:
+        line = inf.readline()
+        parts = line.split(",")
+        if len(parts) != 2:
+            raise ReleaseEnvironmentError("Image information file (%s) does not contain <name>,<path>" % info_file)
+        return (parts[0].strip(), parts[1].strip())
+
 class ReleaseCreator:
-    def __init__(self, targets, target_info_base_dir, version, changelog_filename, target_dir):
+    def __init__(self, targets, target_info_base_dir, version, changelog_filename, target_dir, budgets=None):
         self.targets = targets
         self.target_info_base_dir = target_info_base_dir
         self.images = []
@@ -32,24 +50,19 @@ class ReleaseCreator:
         self.changelog_filename = changelog_filename
         self.target_dir = target_dir
         self.sums = {}
+        # maximum image size in bytes per target, targets without a
+        # budget are not checked
+        if budgets is None:
+            budgets = {}
+        self.budgets = budgets
+        self.size_reports = {}
 
     def check_environment(self):
         if not os.path.exists(self.changelog_filename):
             raise ReleaseEnvironmentError("Changelog file does not exist: %s" % self.changelog_filename)
 
         for target in self.targets:
-            info_file = os.path.join(self.target_info_base_dir, "devices", target, "image_info")
-            if not os.path.exists(info_file):
-                raise ReleaseEnvironmentError("Image information file does not exist: %s" % info_file)
-
-            with open(info_file) as inf:
-                line = inf.readline()
-                parts = line.split(",")
-                if len(parts) != 2:
-                    raise ReleaseEnvironmentError("Image information file (%s) does not contain <name>,<path>" % info_file)
-                image_name = parts[0].strip()
-                image_file = parts[1].strip()
-                self.images.append((image_name, image_file))
+            self.images.append(read_image_info(self.target_info_base_dir, target))
 
     def create_target_tree(self):
         if not os.path.exists(self.target_dir):
@@ -81,6 +94,44 @@ class ReleaseCreator:
                         parts = line.split(" ")
                         self.sums[image[0]] = parts[0] + "\n"
 
+    def check_image_sizes(self):
+        # Use the report made right after the target was built if it
+        # is there and matches the image; the build directories may
+        # have been reused by another target since
+        for target, image in zip(self.targets, self.images):
+            budget = self.budgets.get(target)
+            try:
+                analyzer = ImageSizeAnalyzer(target, image[1], budget)
+                report = None
+                if os.path.exists(analyzer.get_report_path()):
+                    report = read_report(analyzer.get_report_path())
+                    if report["image_size"] != get_file_size(analyzer.get_image_path()):
+                        print("Warning: ignoring outdated image size report %s" % analyzer.get_report_path())
+                        report = None
+                if report is None:
+                    report = analyzer.analyze()
+                report["budget"] = budget
+                # This must be done before the new versions file is written
+                report.pop("previous", None)
+                previous = find_previous_report(self.target_dir, image[0])
+                if previous is not None:
+                    report["previous"] = compare_reports(report, previous)
+                print_report(report)
+            except (ImageSizeError, ValueError, KeyError, TypeError) as exc:
+                # Without a budget the report is informational only
+                if budget is not None:
+                    raise
+                print("Warning: no image size report for %s: %s" % (target, str(exc)))
+                continue
+            check_budget(report)
+            self.size_reports[image[0]] = report
+
+    def write_size_reports(self):
+        for image in self.images:
+            if image[0] not in self.size_reports:
+                continue
+            write_report(self.size_reports[image[0]], "%s/%s/%s.sizes.json" % (self.target_dir, image[0], self.version))
+
     def create_versions_file(self):
         with open("%s/versions.txt" % self.target_dir, "w") as outputfile:
             for image in self.images:
@@ -90,8 +141,10 @@ class ReleaseCreator:
     def create_release(self):
         self.check_environment()
         self.read_sha256sums()
+        self.check_image_sizes()
         self.create_target_tree()
         self.copy_files()
+        self.write_size_reports()
         self.create_versions_file()
         return True
 
@@ -1,13 +1,53 @@
 from .conditionals import *
 from .util import *
-from .releasecreator import ReleaseCreator
+from .releasecreator import ReleaseCreator, read_image_info
+from .imagesize import *
 
 
+class RetryPolicy:
+    """
+    Describes how a failing step is retried. Failures of steps that
+    have a retry policy are considered transient (e.g. network problems
+    during a git fetch), failures of all other steps are fatal and are
+    not retried.
+    """
+    def __init__(self, attempts=3, delay=10, backoff=2):
+        self.attempts = attempts
+        self.delay = delay
+        self.backoff = backoff
+
+    def delays(self):
+        """
+        Yields the number of seconds to wait before each retry
+        """
+        delay = self.delay
+        for _ in range(self.attempts - 1):
+            yield delay
+            delay *= self.backoff
+
+    def __str__(self):
+        return "%d attempts, delay %ds, backoff x%d" % (self.attempts, self.delay, self.backoff)
+
 class Step():
+    # The target device this step builds, or None if the step is
+    # shared by all targets
+    target = None
+    retry_policy = None
+
     def at(self, directory):
         self.directory = directory
         return self
 
+    def retry(self, attempts=3, delay=10, backoff=2):
+        self.retry_policy = RetryPolicy(attempts, delay, backoff)
+        return self
+
+    def failure_class(self):
+        if self.retry_policy is not None:
+            return "transient"
+        else:
+            return "fatal"
+
     def if_true(self, conditional):
         self.conditional = conditional
 
@@ -118,12 +158,12 @@ class UpdatePkgMakefile(Step):
             return basic_cmd("cp %s %s" % (self.makefile + ".tmp", self.makefile))
 
 class CreateReleaseStep(Step):
-    def __init__(self, targets, target_info_base_dir, version_number, changelog_file, target_directory, directory=None):
+    def __init__(self, targets, target_info_base_dir, version_number, changelog_file, target_directory, budgets=None, directory=None):
         self.version_number = version_number
         self.changelog_file = changelog_file
         self.target_directory = target_directory
         self.directory = directory
-        self.rc = ReleaseCreator(targets, target_info_base_dir, version_number, changelog_file, os.path.abspath(target_directory))
+        self.rc = ReleaseCreator(targets, target_info_base_dir, version_number, changelog_file, os.path.abspath(target_directory), budgets)
 
     def perform(self):
         try:
@@ -167,3 +207,54 @@ class ValiboxVersionStep(Step):
         with open(self.VERSIONFILE, "w") as outf:
             outf.write("%s\n" % self.version_string)
         return True
+
+class ImageSizeStep(Step):
+    """
+    This step writes the size report of a built image, compares it
+    to the previous release, and fails if the image exceeds its budget
+    """
+    def __init__(self, target, target_info_base_dir, budget, release_directory, directory=None):
+        self.target = target
+        self.target_info_base_dir = target_info_base_dir
+        self.budget = budget
+        self.release_directory = os.path.abspath(release_directory)
+        self.directory = directory
+
+    def perform(self):
+        try:
+            if self.directory is not None:
+                with gotodir(self.directory):
+                    return self.create_report()
+            else:
+                return self.create_report()
+        except Exception as exc:
+            # Without a budget the report is informational only, and a
+            # problem creating it should not fail the build
+            if self.budget is None:
+                print("Warning: could not create the image size report: " + str(exc))
+                return True
+            print("Image size check failed: " + str(exc))
+            return False
+
+    def __str__(self):
+        if self.budget is not None:
+            budget_str = "check the budget of %d bytes" % self.budget
+        else:
+            budget_str = "no budget"
+        return "In: %s: Write the image size report for %s (%s)" % (self.directory, self.target, budget_str)
+
+    def create_report(self):
+        image_name, image_file = read_image_info(self.target_info_base_dir, self.target)
+        analyzer = ImageSizeAnalyzer(self.target, image_file, self.budget)
+        # Remove the report of an earlier build first, so that it is
+        # not used for this image if the analysis fails
+        if os.path.exists(analyzer.get_report_path()):
+            os.remove(analyzer.get_report_path())
+        report = analyzer.analyze()
+        previous = find_previous_report(self.release_directory, image_name)
+        if previous is not None:
+            report["previous"] = compare_reports(report, previous)
+        write_report(report, analyzer.get_report_path())
+        print_report(report)
+        check_budget(report)
+        return True